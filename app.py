@@ -1,16 +1,14 @@
 import streamlit as st
 import folium
-import pickle
 import requests
-import networkx as nx
 import pandas as pd
 from streamlit_folium import st_folium
-from shapely.geometry import LineString
-from scipy.spatial import KDTree
 from branca.element import MacroElement
 from jinja2 import Template
 from pyproj import Transformer
 import base64
+import preload
+from exposure_tiles import load_tile_meta
 
 # ========== 系統參數 ==========
 map_center = [25.04, 121.56]  # 台北市中心
@@ -26,23 +24,13 @@ class DisableDoubleClickZoom(MacroElement):
             {% endmacro %}
         """)
 
-# ========== 讀取圖 ==========
-@st.cache_resource
-def load_graph():
-    pkl_path = r"data/雙北基隆路網_濃度與暴露_最大連通版.pkl"
-    with open(pkl_path, "rb") as f:
-        G = pickle.load(f)
-
-    transformer = Transformer.from_crs("epsg:3826", "epsg:4326", always_xy=True)
-    mapping = {}
-    for node in list(G.nodes):
-        lon, lat = transformer.transform(node[0], node[1])
-        mapping[(lat, lon)] = node
-        G.nodes[node]["latlon"] = (lat, lon)
-
-    G.graph['latlon_nodes'] = list(mapping.keys())
-    G.graph['node_lookup'] = mapping
-    return G
+# ========== 路網載入中 ==========
+@st.fragment(run_every=1)
+def warmup_notice():
+    # 背景預載完成前每秒檢查一次，完成或失敗後重新執行整個頁面，停止輪詢
+    if preload.status()["status"] in ("ready", "error"):
+        st.rerun()
+    st.info("⏳ 路網載入中，請稍候…")
 
 # ====== Google Geocoding ======
 def geocode(address):
@@ -80,50 +68,17 @@ def reverse_geocode(lat, lon):
 
 # ========== 找最近節點 ==========
 def find_nearest_node(G, lat, lon, max_dist=0.01):
-    kdtree = KDTree(G.graph['latlon_nodes'])
-    dist, idx = kdtree.query((lat, lon))
-    if dist > max_dist:
-        return None
-    latlon = G.graph['latlon_nodes'][idx]
-    return G.graph['node_lookup'][latlon]
+    return G.nearest_node(lat, lon, max_dist)
 
 # ========== 路徑計算 ==========
 def compute_path(G, start_node, end_node, weight):
-    try:
-        if isinstance(weight, dict):
-            def cost(u, v, d):
-                attrs = d.get("attr_dict", {})
-                return sum(attrs.get(k, 0) * w for k, w in weight.items())
-            path = nx.shortest_path(G, start_node, end_node, weight=cost)
-        else:
-            path = nx.shortest_path(
-                G, start_node, end_node,
-                weight=lambda u, v, d: max(0, d.get("attr_dict", {}).get(weight, 0))
-            )
-    except nx.NetworkXNoPath:
+    result = G.shortest_path(start_node, end_node, weight)
+    if result is None:
         return None, 0, 0, 0, 0
 
-    total = 0
-    PM25_acc = 0
-    NO2_acc = 0
-    WBGT_acc = 0
-    for u, v in zip(path[:-1], path[1:]):
-        edge_data = G.get_edge_data(u, v)
-        if edge_data and "attr_dict" in edge_data:
-            attrs = edge_data["attr_dict"]
-            total += attrs.get("length", 0)
-            PM25_acc += attrs.get("PM25_expo", 0)
-            NO2_acc += attrs.get("NO2_expo", 0)
-            WBGT_acc += attrs.get("WBGT_expo", 0)
-        else:
-            for d in edge_data.values():
-                attrs = d.get("attr_dict", {})
-                total += attrs.get("length", 0)
-                PM25_acc += attrs.get("PM25_expo", 0)
-                NO2_acc += attrs.get("NO2_expo", 0)
-                WBGT_acc += attrs.get("WBGT_expo", 0)
-
-    return path, total, PM25_acc, NO2_acc, WBGT_acc
+    _, edges = result
+    totals = G.path_totals(edges)
+    return edges, totals["length"], totals["PM25_expo"], totals["NO2_expo"], totals["WBGT_expo"]
 
 
 # pm25_weight no2_weight WBGT_weight
@@ -186,7 +141,17 @@ with col1:
     if "transport_mode" not in st.session_state:
         st.session_state.transport_mode = "機車"
 
-    G = load_graph()
+    state = preload.status()
+    if state["status"] == "error":
+        st.error(f"⚠️ 路網載入失敗：{state['error']}")
+        if st.button("🔁 重新載入路網"):
+            preload.start()
+            st.rerun()
+    else:
+        preload.start()
+    G = preload.get_graph()
+    if G is None and state["status"] != "error":
+        warmup_notice()
     if "points" not in st.session_state: st.session_state.points = []
     if "nodes" not in st.session_state: st.session_state.nodes = []
 
@@ -213,11 +178,11 @@ with col1:
     ###### 權重調整
     row4 = st.columns([1,1,1])
     with row4[0]:
-        pm25_weight = st.slider("PM₂․₅ 權重 (%)", 0, 100, 50, step=10, key="pm25_weight")
+        pm25_weight = st.slider("PM₂․₅ 權重 (%)", 0, 100, preload.DEFAULT_WEIGHTS["PM25_expo"], step=10, key="pm25_weight")
     with row4[1]:
-        no2_weight = st.slider("NO₂ 權重 (%)", 0, 100, 30, step=10, key="no2_weight")
+        no2_weight = st.slider("NO₂ 權重 (%)", 0, 100, preload.DEFAULT_WEIGHTS["NO2_expo"], step=10, key="no2_weight")
     with row4[2]:
-        WBGT_weight = st.slider("氣溫 權重 (%)", 0, 100, 80, step=10, key="WBGT_weight")
+        WBGT_weight = st.slider("氣溫 權重 (%)", 0, 100, preload.DEFAULT_WEIGHTS["WBGT_expo"], step=10, key="WBGT_weight")
 
 
 
@@ -295,7 +260,7 @@ with col1:
             }
             </style>
         """, unsafe_allow_html=True)
-        if st.button("🧭 路徑解算", disabled=st.session_state.disable_inputs):
+        if st.button("🧭 路徑解算", disabled=st.session_state.disable_inputs or G is None):
             if not start_address.strip():
                 st.warning("⚠️ 請輸入起點地址")
             elif not end_address.strip():
@@ -308,7 +273,7 @@ with col1:
                 else:
                     start_lat, start_lon = start_result
                     start_node = find_nearest_node(G, start_lat, start_lon)
-                    if not start_node:
+                    if start_node is None:
                         st.warning("⚠️ 起點離路網太遠")
                     else:
                         # 終點處理
@@ -318,13 +283,13 @@ with col1:
                         else:
                             end_lat, end_lon = end_result
                             end_node = find_nearest_node(G, end_lat, end_lon)
-                            if not end_node:
+                            if end_node is None:
                                 st.warning("⚠️ 終點離路網太遠")
                             else:
                                 # 一切成功，儲存節點與位置
                                 st.session_state.points = [
-                                    list(G.nodes[start_node]["latlon"]),
-                                    list(G.nodes[end_node]["latlon"]),
+                                    list(G.latlon(start_node)),
+                                    list(G.latlon(end_node)),
                                 ]
                                 st.session_state.nodes = [start_node, end_node]
                                 st.session_state.has_routed = True
@@ -353,15 +318,7 @@ with col1:
     SPEED = {"機車": 45, "單車": 18, "步行": 5}[transport_mode]
 
     if st.session_state.has_routed and len(st.session_state.nodes) == 2:
-        total = pm25_weight + no2_weight + WBGT_weight
-        if total == 0:
-            weights = "length"
-        else:
-            weights = {
-                "PM25_expo": pm25_weight / total,
-                "NO2_expo": no2_weight / total,
-                "WBGT_expo": WBGT_weight / total
-            }
+        weights = preload.route_weight({"PM25_expo": pm25_weight, "NO2_expo": no2_weight, "WBGT_expo": WBGT_weight})
 
         path1, dist1, PM25_acc1, NO2_acc1, WBGT_acc1 = compute_path(G, *st.session_state.nodes, "length")
         path2, dist2, PM25_acc2, NO2_acc2, WBGT_acc2 = compute_path(G, *st.session_state.nodes, weights)
@@ -503,7 +460,8 @@ with col3:
             🟢 輸入起點與終點地址（或點選地圖設定起終點）<br>
             🚘 選擇交通方式：機車、單車或步行<br>
             🧭 點選「路徑解算」：計算兩種路徑（最短/最低暴露），顯示統計表格<br>
-            ✅ 點選「空汙疊圖」可查看PM2.5濃度背景圖層
+            ✅ 點選「空汙疊圖」可查看PM2.5濃度背景圖層<br>
+            🛣️ 勾選「道路層級」可查看各路段的平均暴露
             </div>
         """, unsafe_allow_html=True)
 
@@ -558,6 +516,17 @@ with col3:
             )
             st.markdown('</div>', unsafe_allow_html=True)
 
+            # 有預先產生的向量圖磚時，可改以道路為單位顯示暴露；沒有圖磚時停用
+            overlay_attrs = {"PM₂.₅": "PM25_expo", "NO₂": "NO2_expo", "氣溫": "WBGT_expo"}
+            tile_meta = load_tile_meta(overlay_attrs[overlay_option]) if overlay_option in overlay_attrs else None
+            road_level = st.checkbox(
+                "道路層級",
+                key="road_level_overlay",
+                disabled=tile_meta is None,
+                help="此圖層尚未產生道路暴露圖磚（python exposure_tiles.py）"
+                     if overlay_option in overlay_attrs and tile_meta is None else None,
+            ) and tile_meta is not None
+
         # 更新 session_state 對應疊圖層狀態
         if overlay_option == "無":
             st.session_state.pop("active_overlay", None)
@@ -592,6 +561,20 @@ with col3:
                 width: 100%;
                 line-height: 1.4;
             }
+            .road-legend-row {
+                display: flex;
+                align-items: center;
+                justify-content: center;
+                gap: 6px;
+                font-size: 12px;
+                font-weight: 400;
+            }
+            .road-legend-swatch {
+                display: inline-block;
+                width: 18px;
+                height: 4px;
+                border-radius: 2px;
+            }
             </style>
         """, unsafe_allow_html=True)
 
@@ -607,6 +590,22 @@ with col3:
             </div>
         """, unsafe_allow_html=True)
 
+        # 道路層級圖例：各顏色對應的每公尺平均暴露範圍（exposure_tiles.py 的分級）
+        if road_level:
+            breaks, colors = tile_meta["breaks"], tile_meta["colors"]
+            ranges = ([f"≤ {breaks[0]:.3g}"]
+                      + [f"{lo:.3g} – {hi:.3g}" for lo, hi in zip(breaks[:-1], breaks[1:])]
+                      + [f"> {breaks[-1]:.3g}"])
+            rows = "".join(
+                f'<div class="road-legend-row"><span class="road-legend-swatch" style="background-color: {color};"></span>{label}</div>'
+                for color, label in zip(colors, ranges)
+            )
+            st.markdown(f"""
+                <div class="legend-wrapper">
+                    <div class="legend-label">{overlay_option} 道路暴露<br><span style="font-size: 12px; font-weight: 400;">每公尺平均</span>{rows}</div>
+                </div>
+            """, unsafe_allow_html=True)
+
 
 
 
@@ -623,24 +622,20 @@ with col3:
 
         if st.session_state.has_routed and len(st.session_state.nodes) == 2:
             for path, color, label in [
-                (compute_path(G, *st.session_state.nodes, "length")[0], "blue", "最短路徑"),
-                (compute_path(G, *st.session_state.nodes, weights)[0], "#00d26a", "最低暴露路徑")
+                (path1, "blue", "最短路徑"),
+                (path2, "#00d26a", "最低暴露路徑")
             ]:
-                for u, v in zip(path[:-1], path[1:]):
-                    edge_data = G.get_edge_data(u, v)
-                    if edge_data:
-                        for d in edge_data.values():
-                            geom = d.get("attr_dict", {}).get("geometry")
-                            if geom:
-                                coords = [(lat, lon) for lon, lat in geom.coords]
-                                folium.PolyLine(coords, color=color, weight=4, tooltip=label).add_to(m)
-                            else:
-                                pt1 = G.nodes[u]["latlon"]
-                                pt2 = G.nodes[v]["latlon"]
-                                folium.PolyLine([pt1, pt2], color=color, weight=4, tooltip=label).add_to(m)
+                for edge in path:
+                    coords = G.edge_coords(edge)
+                    if coords:
+                        folium.PolyLine(coords, color=color, weight=4, tooltip=label).add_to(m)
+                    else:
+                        u, v = G.edge_endpoints(edge)
+                        folium.PolyLine([G.latlon(u), G.latlon(v)], color=color, weight=4, tooltip=label).add_to(m)
 
         # 加入 PM2.5、NO2、WBGT 疊圖層（PNG）
         from folium.raster_layers import ImageOverlay
+        from folium.plugins import VectorGridProtobuf
         import base64
 
         overlay_options = { # 圖片路徑及經緯度
@@ -684,7 +679,24 @@ with col3:
         # 顯示對應疊圖層
         if "active_overlay" in st.session_state:
             selected = st.session_state.active_overlay
-            if selected in overlay_options:
+            if road_level:
+                # 道路暴露向量圖磚（exposure_tiles.py 產生），只載入畫面內的圖磚
+                VectorGridProtobuf(
+                    f"/app/static/tiles/{overlay_attrs[selected]}/{{z}}/{{x}}/{{y}}.pbf",
+                    name=selected,
+                    options=f"""{{
+                        "interactive": false,
+                        "minZoom": {tile_meta["min_zoom"]},
+                        "maxNativeZoom": {tile_meta["max_zoom"]},
+                        "vectorTileLayerStyles": {{
+                            "{tile_meta["layer"]}": function(p, z) {{
+                                return {{"color": p.color, "weight": z >= 15 ? 3 : 2, "opacity": 0.8}};
+                            }}
+                        }}
+                    }}""",
+                    control=False,
+                ).add_to(m)
+            elif selected in overlay_options:
                 info = overlay_options[selected]
                 bounds = info["bounds_twd97"]
                 transformer = Transformer.from_crs("EPSG:3826", "EPSG:4326", always_xy=True)
@@ -709,11 +721,11 @@ with col3:
 
         st_data = st_folium(m, width=600, height=600)
 
-        if not st.session_state.disable_inputs and st_data and st_data.get("last_clicked"):
+        if not st.session_state.disable_inputs and G is not None and st_data and st_data.get("last_clicked"):
             latlon = [st_data["last_clicked"]["lat"], st_data["last_clicked"]["lng"]]
             nearest_node = find_nearest_node(G, *latlon)
-            if nearest_node:
-                lat_, lon_ = G.nodes[nearest_node]["latlon"]
+            if nearest_node is not None:
+                lat_, lon_ = G.latlon(nearest_node)
                 st.session_state.nodes.append(nearest_node)
                 st.session_state.points.append([lat_, lon_])
 
@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import math
+import shutil
+import struct
+from collections import defaultdict
+
+import numpy as np
+import shapely
+
+from graph_store import CompactGraph
+
+# ========== 道路暴露向量圖磚 ==========
+# 依每條路段的平均暴露（暴露量 / 長度）上色，預先切成 Mapbox Vector Tile（.pbf），
+# 放在 static/tiles/<屬性>/{z}/{x}/{y}.pbf，由 streamlit 靜態檔案服務提供，
+# 地圖只載入畫面內的圖磚。每個縮放層級先依螢幕像素簡化線段，過短的路段直接省略。
+#   python exposure_tiles.py <精簡路網目錄> [輸出目錄] [最小縮放] [最大縮放]
+TILE_DIR = "static/tiles"
+TILE_ATTRS = ["PM25_expo", "NO2_expo", "WBGT_expo"]
+LAYER_NAME = "exposure"
+EXTENT = 4096
+BUFFER = 64                 # 圖磚四周多留的範圍（extent 單位），避免線段在邊界斷開
+SIMPLIFY_PX = 0.5           # 簡化容許誤差（螢幕像素）
+COLORS = ["#1a9850", "#91cf60", "#d9ef8b", "#fee08b", "#fc8d59", "#d73027"]
+
+
+# ========== MVT 編碼 ==========
+def _varint(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _bytes_field(field, payload):
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+
+def _packed(field, values):
+    return _bytes_field(field, b"".join(_varint(v) for v in values))
+
+
+def _line_commands(coords):
+    # MoveTo 到第一點，LineTo 其餘各點，座標為相對前一點的 zigzag 差值
+    deltas = np.diff(coords, axis=0, prepend=[[0, 0]])
+    cmds = [(1 & 7) | (1 << 3), _zigzag(int(deltas[0, 0])), _zigzag(int(deltas[0, 1])),
+            (2 & 7) | ((len(coords) - 1) << 3)]
+    for dx, dy in deltas[1:].tolist():
+        cmds += [_zigzag(dx), _zigzag(dy)]
+    return cmds
+
+
+def encode_tile(features):
+    # features: [(整數座標 (n, 2), 屬性 dict)]，只支援 LineString
+    keys, values = {}, {}
+    body = []
+    for coords, props in features:
+        tags = []
+        for k, v in props.items():
+            tags.append(keys.setdefault(k, len(keys)))
+            tags.append(values.setdefault(v, len(values)))
+        feature = _packed(2, tags) + _key(3, 0) + _varint(2) + _packed(4, _line_commands(coords))
+        body.append(_bytes_field(2, feature))
+
+    layer = _key(15, 0) + _varint(2) + _bytes_field(1, LAYER_NAME.encode("utf-8")) + b"".join(body)
+    for k in keys:
+        layer += _bytes_field(3, k.encode("utf-8"))
+    for v in values:
+        if isinstance(v, str):
+            value = _bytes_field(1, v.encode("utf-8"))
+        else:
+            value = _key(2, 5) + struct.pack("<f", v)
+        layer += _bytes_field(4, value)
+    layer += _key(5, 0) + _varint(EXTENT)
+    return _bytes_field(3, layer)
+
+
+# ========== 路段與暴露值 ==========
+def road_segments(CG):
+    # 無向圖兩個方向共用幾何，每段幾何只取一次；沒有幾何的邊以兩端點連線代替
+    src = np.repeat(np.arange(CG.n_nodes), np.diff(CG.indptr))
+    dst = np.asarray(CG.indices)
+    edge_geom = np.asarray(CG.edge_geom)
+    gids, first = np.unique(edge_geom, return_index=True)
+    with_geom = first[gids >= 0]
+    no_geom = np.flatnonzero((edge_geom < 0) & ((src < dst) | CG.meta["directed"]))
+
+    lengths = np.diff(CG.geom_offsets)[edge_geom[with_geom]]
+    starts = CG.geom_offsets[edge_geom[with_geom]]
+    coord_index = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths) + np.arange(lengths.sum())
+    latlon = np.concatenate([
+        np.asarray(CG.geom_coords[coord_index], dtype=np.float64),
+        np.asarray(CG.node_latlon, dtype=np.float64)[np.column_stack([src[no_geom], dst[no_geom]]).ravel()],
+    ])
+    line_index = np.concatenate([np.repeat(np.arange(len(with_geom)), lengths),
+                                 np.repeat(np.arange(len(no_geom)) + len(with_geom), 2)])
+    return np.concatenate([with_geom, no_geom]), latlon, line_index
+
+
+def exposure_rate(CG, edges, attr):
+    # 與統計表格相同：每公尺通勤距離下的平均暴露
+    length = np.asarray(CG.attrs["length"][edges], dtype=np.float64)
+    expo = np.asarray(CG.attrs[attr][edges], dtype=np.float64)
+    return np.divide(expo, length, out=np.zeros_like(expo), where=length > 0)
+
+
+def color_breaks(rate):
+    return np.quantile(rate, np.linspace(0, 1, len(COLORS) + 1)[1:-1]).tolist()
+
+
+# ========== 座標投影 ==========
+def web_mercator(latlon, world):
+    lat = np.clip(latlon[:, 0], -85.0511, 85.0511)
+    x = (latlon[:, 1] + 180.0) / 360.0 * world
+    y = (1.0 - np.log(np.tan(np.radians(lat)) + 1.0 / np.cos(np.radians(lat))) / math.pi) / 2.0 * world
+    return np.column_stack([x, y])
+
+
+# ========== 切圖磚 ==========
+def build_zoom(lines, props, z, out_dir):
+    tol = SIMPLIFY_PX * EXTENT / 256
+    lines = shapely.simplify(lines, tol)
+    keep = shapely.length(lines) >= tol
+    lines, props = lines[keep], [p for p, k in zip(props, keep) if k]
+
+    bounds = shapely.bounds(lines)
+    tx0, ty0 = np.floor((bounds[:, :2] - BUFFER) / EXTENT).astype(np.int64).T
+    tx1, ty1 = np.floor((bounds[:, 2:] + BUFFER) / EXTENT).astype(np.int64).T
+    tiles = defaultdict(list)
+    for i in range(len(lines)):
+        for tx in range(tx0[i], tx1[i] + 1):
+            for ty in range(ty0[i], ty1[i] + 1):
+                tiles[(tx, ty)].append(i)
+
+    for (tx, ty), idx in tiles.items():
+        x0, y0 = tx * EXTENT, ty * EXTENT
+        clipped = shapely.clip_by_rect(lines[idx], x0 - BUFFER, y0 - BUFFER, x0 + EXTENT + BUFFER, y0 + EXTENT + BUFFER)
+        parts, part_of = shapely.get_parts(clipped, return_index=True)
+        coords, coord_of = shapely.get_coordinates(parts, return_index=True)
+        coords = np.rint(coords - [x0, y0]).astype(np.int64)
+        splits = np.flatnonzero(np.diff(coord_of)) + 1
+
+        features = []
+        for part, pc in zip(part_of, np.split(coords, splits)):
+            # 取整後重複的點會讓 LineTo 長度為 0，先去除
+            pc = pc[np.concatenate([[True], np.any(np.diff(pc, axis=0) != 0, axis=1)])]
+            if len(pc) >= 2:
+                features.append((pc, props[idx[part]]))
+        if not features:
+            continue
+        tile_dir = os.path.join(out_dir, str(z), str(tx))
+        os.makedirs(tile_dir, exist_ok=True)
+        with open(os.path.join(tile_dir, f"{ty}.pbf"), "wb") as f:
+            f.write(encode_tile(features))
+    return len(tiles)
+
+
+def build_exposure_tiles(CG, out_root=TILE_DIR, min_zoom=11, max_zoom=16, attrs=TILE_ATTRS):
+    edges, latlon, line_index = road_segments(CG)
+    for attr in attrs:
+        rate = exposure_rate(CG, edges, attr)
+        breaks = color_breaks(rate)
+        classes = np.searchsorted(breaks, rate)
+        props = [{"value": round(float(r), 3), "color": COLORS[c]} for r, c in zip(rate, classes)]
+
+        out_dir = os.path.join(out_root, attr)
+        shutil.rmtree(out_dir, ignore_errors=True)
+        for z in range(min_zoom, max_zoom + 1):
+            lines = shapely.linestrings(web_mercator(latlon, EXTENT * 2 ** z), indices=line_index)
+            n_tiles = build_zoom(lines, props, z, out_dir)
+            print(f"{attr} z{z}: {n_tiles} tiles")
+
+        meta = {
+            "layer": LAYER_NAME, "min_zoom": min_zoom, "max_zoom": max_zoom,
+            "breaks": breaks, "colors": COLORS,
+        }
+        with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+
+def load_tile_meta(attr, out_root=TILE_DIR):
+    path = os.path.join(out_root, attr, "meta.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    if not 2 <= len(sys.argv) <= 5:
+        print("用法: python exposure_tiles.py <精簡路網目錄> [輸出目錄] [最小縮放] [最大縮放]")
+        sys.exit(1)
+    out_root = sys.argv[2] if len(sys.argv) > 2 else TILE_DIR
+    min_zoom = int(sys.argv[3]) if len(sys.argv) > 3 else 11
+    max_zoom = int(sys.argv[4]) if len(sys.argv) > 4 else 16
+    build_exposure_tiles(CompactGraph(sys.argv[1]), out_root, min_zoom, max_zoom)
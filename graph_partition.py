@@ -0,0 +1,439 @@
+import os
+import sys
+import json
+import math
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from graph_store import (CompactGraph, coords_to_linestring, geometry_coords, replace_dir,
+                         save_compact_graph, weighted_costs)
+
+# ========== 分區路網格式 ==========
+# 依經緯度網格把路網切成多個分區，每個分區是一份獨立的精簡路網（graph_store 格式），
+# 跨分區的邊另存成一張小的邊界圖（boundary/），查詢時常駐記憶體：
+#   index.json          網格大小、分區列表與來源 pickle（同 graph_store 的 source）
+#   p<id>/              分區內部的節點與邊
+#   boundary/           跨分區的邊：src、dst 為全域節點編號
+#   overlay/            邊界節點（跨分區邊的端點）與各分區內邊界節點兩兩之間的最短距離（捷徑），
+#                       每個屬性一份，單一屬性查詢時起終點以外的分區只走捷徑，不必載入
+# 全域節點編號 = (分區編號 << 32) | 分區內節點編號
+# 邊的編號為 (分區編號, 分區內邊編號)，邊界圖上的邊分區編號為 BOUNDARY
+PART_SHIFT = 32
+LOCAL_MASK = (1 << PART_SHIFT) - 1
+BOUNDARY = -1
+SHORTCUT = -2
+
+
+def make_gid(pid, local):
+    return (pid << PART_SHIFT) | local
+
+
+def split_gid(gid):
+    return gid >> PART_SHIFT, gid & LOCAL_MASK
+
+
+def has_partitions(path, source=None):
+    index_path = os.path.join(path, "index.json")
+    if not os.path.exists(index_path):
+        return False
+    if source is None:
+        return True
+    with open(index_path, encoding="utf-8") as f:
+        return json.load(f).get("source") == source
+
+
+# ========== 幾何子集 ==========
+def gather_geoms(edge_geom, geom_offsets, geom_coords):
+    used, inverse = np.unique(edge_geom, return_inverse=True)
+    if len(used) and used[0] < 0:
+        new_edge_geom = inverse.astype(np.int32) - 1
+        used = used[1:]
+    else:
+        new_edge_geom = inverse.astype(np.int32)
+
+    lengths = geom_offsets[used + 1] - geom_offsets[used]
+    new_offsets = np.zeros(len(used) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    src_index = np.repeat(geom_offsets[used] - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    return new_edge_geom, new_offsets, np.asarray(geom_coords[src_index], dtype=np.float32).reshape(-1, 2)
+
+
+# ========== 邊界捷徑 ==========
+def boundary_shortcuts(indptr, indices, costs, sources, chunk=256):
+    # 分區內從每個邊界節點出發的最短距離，只保留到其他邊界節點的部分
+    n = len(indptr) - 1
+    graph = csr_matrix((costs, indices, indptr), shape=(n, n))
+    block = np.empty((len(sources), len(sources)), dtype=np.float32)
+    for i in range(0, len(sources), chunk):
+        block[i:i + chunk] = dijkstra(graph, indices=sources[i:i + chunk])[:, sources]
+    return block
+
+
+# ========== 由精簡路網切分 ==========
+def build_partitions(CG, out_dir, tile_deg=0.1):
+    # 整個分區目錄先建在暫存名稱下，完成後一次換上
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    latlon = np.asarray(CG.node_latlon, dtype=np.float64)
+    tiles = np.floor(latlon / tile_deg).astype(np.int64)
+    keys, node_pid = np.unique(tiles, axis=0, return_inverse=True)
+    node_pid = node_pid.reshape(-1)
+
+    # 分區內節點維持原本順序，CSR 的 src 排序才能沿用
+    order = np.argsort(node_pid, kind="stable")
+    counts = np.bincount(node_pid, minlength=len(keys))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    node_local = np.empty(CG.n_nodes, dtype=np.int64)
+    node_local[order] = np.arange(CG.n_nodes) - np.repeat(starts, counts)
+
+    src = np.repeat(np.arange(CG.n_nodes), np.diff(CG.indptr))
+    dst = np.asarray(CG.indices, dtype=np.int64)
+    edge_geom = np.asarray(CG.edge_geom)
+    same = node_pid[src] == node_pid[dst]
+    cut = np.flatnonzero(~same)
+    cut_src = make_gid(node_pid[src[cut]], node_local[src[cut]])
+    cut_dst = make_gid(node_pid[dst[cut]], node_local[dst[cut]])
+
+    # 邊界節點依全域編號排序，同一分區的節點自然相鄰
+    overlay_nodes = np.unique(np.concatenate([cut_src, cut_dst]))
+    part_ptr = np.searchsorted(overlay_nodes >> PART_SHIFT, np.arange(len(keys) + 1))
+    shortcuts = {name: [] for name in CG.attrs}
+
+    partitions = []
+    for pid, (row, col) in enumerate(keys):
+        nodes = order[starts[pid]:starts[pid] + counts[pid]]
+        edges = np.flatnonzero(same & (node_pid[src] == pid))
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(node_local[src[edges]], minlength=len(nodes)), out=indptr[1:])
+        sub_geom, sub_offsets, sub_coords = gather_geoms(edge_geom[edges], CG.geom_offsets, CG.geom_coords)
+
+        arrays = {
+            "node_latlon": np.asarray(CG.node_latlon[nodes]),
+            "indptr": indptr,
+            "indices": node_local[dst[edges]].astype(np.int32),
+            "edge_geom": sub_geom,
+            "geom_offsets": sub_offsets,
+            "geom_coords": sub_coords,
+        }
+        for name, arr in CG.attrs.items():
+            arrays[f"attr_{name}"] = np.asarray(arr[edges])
+        meta = dict(CG.meta, n_nodes=len(nodes), n_edges=len(edges))
+        save_compact_graph(arrays, meta, os.path.join(tmp_dir, f"p{pid}"))
+        partitions.append({"id": pid, "row": int(row), "col": int(col), "n_nodes": len(nodes)})
+
+        sources = overlay_nodes[part_ptr[pid]:part_ptr[pid + 1]] & LOCAL_MASK
+        attrs = {name: arrays[f"attr_{name}"] for name in CG.attrs}
+        for name in CG.attrs:
+            costs = weighted_costs(attrs, name, len(edges))
+            shortcuts[name].append(boundary_shortcuts(indptr, arrays["indices"], costs, sources).ravel())
+
+    cut_geom, cut_offsets, cut_coords = gather_geoms(edge_geom[cut], CG.geom_offsets, CG.geom_coords)
+    arrays = {
+        "src": cut_src,
+        "dst": cut_dst,
+        "edge_geom": cut_geom,
+        "geom_offsets": cut_offsets,
+        "geom_coords": cut_coords,
+    }
+    for name, arr in CG.attrs.items():
+        arrays[f"attr_{name}"] = np.asarray(arr[cut])
+    save_compact_graph(arrays, dict(CG.meta, n_nodes=0, n_edges=len(cut)), os.path.join(tmp_dir, "boundary"))
+
+    block_ptr = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(np.diff(part_ptr) ** 2, out=block_ptr[1:])
+    arrays = {"nodes": overlay_nodes, "part_ptr": part_ptr, "block_ptr": block_ptr}
+    for name, blocks in shortcuts.items():
+        arrays[f"shortcut_{name}"] = np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)
+    save_compact_graph(arrays, {"metrics": list(CG.attrs)}, os.path.join(tmp_dir, "overlay"))
+
+    index = {"tile_deg": tile_deg, "partitions": partitions, "source": CG.meta.get("source")}
+    index_path = os.path.join(tmp_dir, "index.json")
+    with open(f"{index_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(f"{index_path}.tmp", index_path)
+    replace_dir(tmp_dir, out_dir)
+
+
+# ========== 分區路網（按需載入） ==========
+class PartitionedGraph:
+    def __init__(self, path, max_resident=16):
+        self.path = path
+        self.max_resident = max_resident
+        with open(os.path.join(path, "index.json"), encoding="utf-8") as f:
+            index = json.load(f)
+        self.tile_deg = index["tile_deg"]
+        self.partitions = index["partitions"]
+        self.tiles = {(p["row"], p["col"]): p["id"] for p in self.partitions}
+        self.n_partitions = len(self.partitions)
+
+        boundary_dir = os.path.join(path, "boundary")
+        with open(os.path.join(boundary_dir, "meta.json"), encoding="utf-8") as f:
+            self.boundary_meta = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(boundary_dir, f"{name}.npy"), mmap_mode="r")
+
+        self.b_src = load("src")
+        self.b_dst = load("dst")
+        self.b_edge_geom = load("edge_geom")
+        self.b_geom_offsets = load("geom_offsets")
+        self.b_geom_coords = load("geom_coords")
+        self.b_attrs = {name: load(f"attr_{name}") for name in self.boundary_meta["attrs"]}
+        self.b_src_pid = np.asarray(self.b_src) >> PART_SHIFT
+        self.b_dst_pid = np.asarray(self.b_dst) >> PART_SHIFT
+
+        overlay_dir = os.path.join(path, "overlay")
+        with open(os.path.join(overlay_dir, "meta.json"), encoding="utf-8") as f:
+            self.overlay_meta = json.load(f)
+        self.ov_nodes = np.load(os.path.join(overlay_dir, "nodes.npy"))
+        self.ov_part_ptr = np.load(os.path.join(overlay_dir, "part_ptr.npy"))
+        self.ov_block_ptr = np.load(os.path.join(overlay_dir, "block_ptr.npy"))
+        self.ov_shortcuts = {
+            name: np.load(os.path.join(overlay_dir, f"shortcut_{name}.npy"), mmap_mode="r")
+            for name in self.overlay_meta["metrics"]
+        }
+
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ---------- 分區 LRU ----------
+    def partition(self, pid):
+        with self._lock:
+            if pid in self._resident:
+                self._resident.move_to_end(pid)
+                return self._resident[pid]
+        part = CompactGraph(os.path.join(self.path, f"p{pid}"))
+        with self._lock:
+            part = self._resident.setdefault(pid, part)
+            self._resident.move_to_end(pid)
+            while len(self._resident) > self.max_resident:
+                self._resident.popitem(last=False)
+        return part
+
+    def resident_partitions(self):
+        with self._lock:
+            return list(self._resident)
+
+    # ---------- 節點 ----------
+    def nearest_node(self, lat, lon, max_dist=0.01):
+        best = None
+        rows = range(math.floor((lat - max_dist) / self.tile_deg), math.floor((lat + max_dist) / self.tile_deg) + 1)
+        cols = range(math.floor((lon - max_dist) / self.tile_deg), math.floor((lon + max_dist) / self.tile_deg) + 1)
+        for row in rows:
+            for col in cols:
+                pid = self.tiles.get((row, col))
+                if pid is None:
+                    continue
+                dist, idx = self.partition(pid).kdtree.query((lat, lon))
+                if dist <= max_dist and (best is None or dist < best[0]):
+                    best = (dist, make_gid(pid, int(idx)))
+        return None if best is None else best[1]
+
+    def latlon(self, node):
+        pid, local = split_gid(node)
+        return self.partition(pid).latlon(local)
+
+    # ---------- 邊 ----------
+    def edge_endpoints(self, edge):
+        pid, eid = edge
+        if pid == BOUNDARY:
+            return int(self.b_src[eid]), int(self.b_dst[eid])
+        u, v = self.partition(pid).edge_endpoints(eid)
+        return make_gid(pid, u), make_gid(pid, v)
+
+    def edge_coords(self, edge):
+        pid, eid = edge
+        if pid != BOUNDARY:
+            return self.partition(pid).edge_coords(eid)
+        return geometry_coords(self.b_edge_geom, self.b_geom_offsets, self.b_geom_coords, eid)
+
+    def edge_geometry(self, edge):
+        return coords_to_linestring(self.edge_coords(edge))
+
+    def path_totals(self, edges):
+        totals = {name: 0.0 for name in self.b_attrs}
+        for pid, eid in edges:
+            attrs = self.b_attrs if pid == BOUNDARY else self.partition(pid).attrs
+            for name in totals:
+                totals[name] += float(attrs[name][eid])
+        return totals
+
+    def boundary_costs(self, weight):
+        return weighted_costs(self.b_attrs, weight, len(self.b_src))
+
+    # ---------- 捷徑 ----------
+    def fixed_metric(self, weight):
+        # 單一屬性（或只有一個正權重）才有預先算好的捷徑，回傳 (屬性, 倍數)
+        if isinstance(weight, str):
+            return (weight, 1.0) if weight in self.ov_shortcuts else None
+        active = [(k, w) for k, w in weight.items() if w > 0]
+        if len(active) == 1 and active[0][0] in self.ov_shortcuts:
+            return active[0]
+        return None
+
+    def shortcut_block(self, pid, name, scale=1.0):
+        # 分區 pid 內邊界節點兩兩之間的最短距離
+        b = int(self.ov_part_ptr[pid + 1] - self.ov_part_ptr[pid])
+        lo, hi = self.ov_block_ptr[pid], self.ov_block_ptr[pid + 1]
+        return np.asarray(self.ov_shortcuts[name][lo:hi], dtype=np.float64).reshape(b, b) * scale
+
+    # ---------- 路徑 ----------
+    # 單一屬性：起終點所在分區完整載入，其餘分區只以邊界節點與捷徑表示，加上跨分區邊，一次搜尋：
+    #   [起點分區節點][終點分區節點][邊界節點]
+    # 權重組合（滑桿）沒有捷徑：從起終點分區開始，只在搜尋距離可能縮短路徑時，
+    # 才把相鄰分區的實際路段逐一加進來；分區經由 LRU 載入，查詢只保留合併用的陣列
+    def _partition_block(self, pid, weight, base):
+        part = self.partition(pid)
+        n = part.n_nodes
+        block = (
+            np.repeat(np.arange(n), np.diff(part.indptr)) + base,
+            np.asarray(part.indices, dtype=np.int64) + base,
+            part.edge_costs(weight),
+            np.full(len(part.indices), pid, dtype=np.int64),
+            np.arange(len(part.indices)),
+        )
+        return block, make_gid(pid, np.arange(n, dtype=np.int64))
+
+    def _shortcut_edges(self, pid, fixed, base):
+        block = self.shortcut_block(pid, *fixed)
+        i, j = np.nonzero(np.isfinite(block))
+        keep = i != j
+        i, j = i[keep], j[keep]
+        lo = self.ov_part_ptr[pid]
+        return (base + lo + i, base + lo + j, block[i, j],
+                np.full(len(i), SHORTCUT, dtype=np.int64), np.full(len(i), pid, dtype=np.int64))
+
+    def _cut_edges(self, in_scope, index, b_costs):
+        # 兩端都在範圍內的跨分區邊；index(gids, pids) 把全域編號換成合併圖上的編號
+        inside = np.flatnonzero(in_scope[self.b_src_pid] & in_scope[self.b_dst_pid])
+        return (
+            index(self.b_src[inside], self.b_src_pid[inside]),
+            index(self.b_dst[inside], self.b_dst_pid[inside]),
+            b_costs[inside],
+            np.full(len(inside), BOUNDARY, dtype=np.int64),
+            inside,
+        )
+
+    def _search(self, blocks, n, s):
+        rows, cols, costs, ref_pid, ref_eid = (np.concatenate(parts) for parts in zip(*blocks))
+        order = np.argsort(rows, kind="stable")
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+        merged = {
+            "indptr": indptr,
+            "indices": cols[order],
+            "costs": costs[order],
+            "ref_pid": ref_pid[order],
+            "ref_eid": ref_eid[order],
+        }
+        graph = csr_matrix((merged["costs"], merged["indices"], indptr), shape=(n, n))
+        dist, pred = dijkstra(graph, indices=s, return_predecessors=True)
+        return merged, dist, pred
+
+    def _trace(self, merged, pred, s, t, gids, weight, base=None):
+        if s != t and pred[t] < 0:
+            return None
+        path = [int(t)]
+        while path[-1] != s:
+            path.append(int(pred[path[-1]]))
+        path.reverse()
+
+        indptr, indices, costs = merged["indptr"], merged["indices"], merged["costs"]
+        nodes, edges = [int(gids[s])], []
+        for u, v in zip(path[:-1], path[1:]):
+            # 平行邊取成本最低的一條
+            lo, hi = indptr[u], indptr[u + 1]
+            candidates = lo + np.flatnonzero(indices[lo:hi] == v)
+            best = candidates[np.argmin(costs[candidates])]
+            pid, eid = int(merged["ref_pid"][best]), int(merged["ref_eid"][best])
+            if pid == SHORTCUT:
+                # 捷徑展開成分區內的實際路徑
+                lu = int(self.ov_nodes[u - base] & LOCAL_MASK)
+                lv = int(self.ov_nodes[v - base] & LOCAL_MASK)
+                sub_nodes, sub_edges = self.partition(eid).shortest_path(lu, lv, weight)
+                nodes += [make_gid(eid, node) for node in sub_nodes[1:]]
+                edges += [(eid, e) for e in sub_edges]
+            else:
+                nodes.append(int(gids[v]))
+                edges.append((pid, eid))
+        return nodes, edges
+
+    def _overlay_path(self, start_node, end_node, weight, fixed):
+        s_pid, s_local = split_gid(start_node)
+        t_pid, t_local = split_gid(end_node)
+        offset = np.full(self.n_partitions, -1, dtype=np.int64)
+        blocks, gids = [], []
+        base = 0
+        for pid in dict.fromkeys([s_pid, t_pid]):
+            offset[pid] = base
+            block, part_gids = self._partition_block(pid, weight, base)
+            blocks.append(block)
+            gids.append(part_gids)
+            base += len(part_gids)
+        for pid in np.flatnonzero(offset < 0).tolist():
+            blocks.append(self._shortcut_edges(pid, fixed, base))
+
+        def index(node_gids, pids):
+            # 起終點分區的節點用分區內編號，其餘分區的節點用邊界節點編號
+            out = base + np.searchsorted(self.ov_nodes, node_gids)
+            full = offset[pids] >= 0
+            out[full] = offset[pids[full]] + (node_gids[full] & LOCAL_MASK)
+            return out
+
+        in_scope = np.ones(self.n_partitions, dtype=bool)
+        blocks.append(self._cut_edges(in_scope, index, self.boundary_costs(weight)))
+        s, t = offset[s_pid] + s_local, offset[t_pid] + t_local
+        merged, _, pred = self._search(blocks, base + len(self.ov_nodes), s)
+        gids = np.concatenate(gids + [self.ov_nodes])
+        return self._trace(merged, pred, s, t, gids, weight, base)
+
+    def _expanding_path(self, start_node, end_node, weight):
+        b_costs = self.boundary_costs(weight)
+        s_pid, s_local = split_gid(start_node)
+        t_pid, t_local = split_gid(end_node)
+        offset = np.full(self.n_partitions, -1, dtype=np.int64)
+        blocks, gids = [], []
+        base = 0
+
+        def index(node_gids, pids):
+            return offset[pids] + (node_gids & LOCAL_MASK)
+
+        added = list(dict.fromkeys([s_pid, t_pid]))
+        while True:
+            # 只補上新納入分區的路段；跨分區邊依目前範圍重新篩選
+            for pid in added:
+                offset[pid] = base
+                block, part_gids = self._partition_block(pid, weight, base)
+                blocks.append(block)
+                gids.append(part_gids)
+                base += len(part_gids)
+            in_scope = offset >= 0
+            s, t = offset[s_pid] + s_local, offset[t_pid] + t_local
+            merged, dist, pred = self._search(blocks + [self._cut_edges(in_scope, index, b_costs)], base, s)
+
+            # 離開目前範圍的邊界邊，若起點端的距離已不小於終點距離，就不可能找到更短路徑
+            leaving = np.flatnonzero(in_scope[self.b_src_pid] & ~in_scope[self.b_dst_pid])
+            src_dist = dist[index(self.b_src[leaving], self.b_src_pid[leaving])]
+            added = np.unique(self.b_dst_pid[leaving[src_dist < dist[t]]]).tolist()
+            if not added:
+                break
+        return self._trace(merged, pred, s, t, np.concatenate(gids), weight)
+
+    def shortest_path(self, start_node, end_node, weight):
+        fixed = self.fixed_metric(weight)
+        if fixed is not None:
+            return self._overlay_path(start_node, end_node, weight, fixed)
+        return self._expanding_path(start_node, end_node, weight)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print("用法: python graph_partition.py <精簡路網目錄> <輸出目錄> [網格大小(度)]")
+        sys.exit(1)
+    tile_deg = float(sys.argv[3]) if len(sys.argv) == 4 else 0.1
+    build_partitions(CompactGraph(sys.argv[1]), sys.argv[2], tile_deg)
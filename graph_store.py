@@ -0,0 +1,336 @@
+import os
+import sys
+import json
+import shutil
+import pickle
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，只能不上鎖
+    fcntl = None
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import KDTree
+from shapely.geometry import LineString
+from pyproj import Transformer
+
+# ========== 精簡路網格式 ==========
+# 目錄內每個陣列一個 .npy 檔，以 mmap 唯讀載入，多個 worker 共用同一份 page cache：
+#   node_latlon   float32 (N, 2)  節點經緯度 (lat, lon)
+#   indptr        int32   (N+1)   CSR 鄰接表
+#   indices       int32   (E)     邊的終點
+#   attr_<name>   float32 (E)     邊屬性（長度與各項暴露量）
+#   edge_geom     int32   (E)     邊對應的幾何編號，-1 表示沒有幾何
+#   geom_offsets  int64   (G+1)   幾何在座標緩衝區中的起訖
+#   geom_coords   float32 (M, 2)  所有邊幾何攤平的座標 (lat, lon)
+# meta.json 的 source 記錄來源 pickle 的大小與修改時間，pickle 更新後會重建
+EDGE_ATTRS = ["length", "PM25_expo", "NO2_expo", "WBGT_expo"]
+
+
+# ========== 由 networkx 圖建立 ==========
+def build_compact_graph(G, out_dir, source=None):
+    transformer = Transformer.from_crs("epsg:3826", "epsg:4326", always_xy=True)
+    nodes = list(G.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    xy = np.asarray(nodes, dtype=np.float64)
+    lon, lat = transformer.transform(xy[:, 0], xy[:, 1])
+    node_latlon = np.column_stack([lat, lon]).astype(np.float32)
+
+    src, dst, edge_geom = [], [], []
+    attr_cols = {name: [] for name in EDGE_ATTRS}
+    geom_offsets = [0]
+    geom_coords = []
+    for u, v, d in G.edges(data=True):
+        attrs = d.get("attr_dict", {})
+        geom = attrs.get("geometry")
+        if geom is not None:
+            gid = len(geom_offsets) - 1
+            geom_coords.extend((lat_, lon_) for lon_, lat_ in geom.coords)
+            geom_offsets.append(len(geom_coords))
+        else:
+            gid = -1
+
+        # 無向圖兩個方向共用同一段幾何
+        directions = [(u, v)] if G.is_directed() else [(u, v), (v, u)]
+        for a, b in directions:
+            src.append(index[a])
+            dst.append(index[b])
+            edge_geom.append(gid)
+            for name in EDGE_ATTRS:
+                attr_cols[name].append(attrs.get(name, 0))
+
+    src = np.asarray(src, dtype=np.int32)
+    order = np.argsort(src, kind="stable")
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int32)
+    np.cumsum(np.bincount(src, minlength=len(nodes)), out=indptr[1:])
+
+    arrays = {
+        "node_latlon": node_latlon,
+        "indptr": indptr,
+        "indices": np.asarray(dst, dtype=np.int32)[order],
+        "edge_geom": np.asarray(edge_geom, dtype=np.int32)[order],
+        "geom_offsets": np.asarray(geom_offsets, dtype=np.int64),
+        "geom_coords": np.asarray(geom_coords, dtype=np.float32).reshape(-1, 2),
+    }
+    for name in EDGE_ATTRS:
+        arrays[f"attr_{name}"] = np.asarray(attr_cols[name], dtype=np.float32)[order]
+
+    meta = {
+        "n_nodes": len(nodes),
+        "n_edges": len(src),
+        "attrs": EDGE_ATTRS,
+        "directed": G.is_directed(),
+        "source": source,
+    }
+    write_compact_graph(arrays, meta, out_dir)
+
+
+def save_compact_graph(arrays, meta, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    for name, arr in arrays.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), arr)
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+
+def write_compact_graph(arrays, meta, out_dir):
+    # 先寫到暫存目錄再整個換上，其他 worker 不會讀到寫一半的檔案
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    save_compact_graph(arrays, meta, tmp_dir)
+    replace_dir(tmp_dir, out_dir)
+
+
+def replace_dir(tmp_dir, out_dir):
+    # 舊目錄先改名移開再刪除；已經 mmap 舊檔案的行程仍可繼續讀取
+    old_dir = f"{out_dir}.old-{os.getpid()}"
+    if os.path.exists(out_dir):
+        os.rename(out_dir, old_dir)
+    os.rename(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+@contextmanager
+def build_lock(path):
+    # 同一時間只讓一個行程建檔，其他行程等待後應重新檢查快取是否已是最新
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.lock", "w") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def source_fingerprint(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def has_compact_graph(path, source=None):
+    # source 為 None 時（例如部署時只附快取、沒有 pickle）不檢查來源
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    if source is None:
+        return True
+    with open(meta_path, encoding="utf-8") as f:
+        return json.load(f).get("source") == source
+
+
+# ========== 共用：邊成本與幾何 ==========
+def weighted_costs(attrs, weight, n_edges):
+    # weight 為屬性名稱，或 {屬性: 權重} 的線性組合
+    if isinstance(weight, dict):
+        costs = np.zeros(n_edges, dtype=np.float64)
+        for k, w in weight.items():
+            costs += attrs[k] * w
+    else:
+        costs = attrs[weight].astype(np.float64)
+    # Dijkstra 不接受負權重
+    return np.maximum(costs, 0, out=costs)
+
+
+def geometry_coords(edge_geom, geom_offsets, geom_coords, edge):
+    gid = edge_geom[edge]
+    if gid < 0:
+        return None
+    start, end = geom_offsets[gid], geom_offsets[gid + 1]
+    return [(float(lat), float(lon)) for lat, lon in geom_coords[start:end]]
+
+
+def coords_to_linestring(coords):
+    if coords is None:
+        return None
+    return LineString([(lon, lat) for lat, lon in coords])
+
+
+# ========== 唯讀精簡路網 ==========
+class CompactGraph:
+    def __init__(self, path, mmap_mode="r"):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        self.node_latlon = load("node_latlon")
+        self.indptr = load("indptr")
+        self.indices = load("indices")
+        self.edge_geom = load("edge_geom")
+        self.geom_offsets = load("geom_offsets")
+        self.geom_coords = load("geom_coords")
+        self.attrs = {name: load(f"attr_{name}") for name in self.meta["attrs"]}
+        self._kdtree = None
+
+    @property
+    def n_nodes(self):
+        return self.meta["n_nodes"]
+
+    # ---------- 節點 ----------
+    @property
+    def kdtree(self):
+        if self._kdtree is None:
+            self._kdtree = KDTree(self.node_latlon)
+        return self._kdtree
+
+    def nearest_node(self, lat, lon, max_dist=0.01):
+        dist, idx = self.kdtree.query((lat, lon))
+        if dist > max_dist:
+            return None
+        return int(idx)
+
+    def latlon(self, node):
+        lat, lon = self.node_latlon[node]
+        return float(lat), float(lon)
+
+    # ---------- 邊 ----------
+    def edge_costs(self, weight):
+        return weighted_costs(self.attrs, weight, self.meta["n_edges"])
+
+    def edge_endpoints(self, edge):
+        u = int(np.searchsorted(self.indptr, edge, side="right")) - 1
+        return u, int(self.indices[edge])
+
+    def edge_coords(self, edge):
+        return geometry_coords(self.edge_geom, self.geom_offsets, self.geom_coords, edge)
+
+    def edge_geometry(self, edge):
+        return coords_to_linestring(self.edge_coords(edge))
+
+    def path_totals(self, edges):
+        edges = np.asarray(edges, dtype=np.int64)
+        return {name: float(arr[edges].sum(dtype=np.float64)) for name, arr in self.attrs.items()}
+
+    # ---------- 路徑 ----------
+    def shortest_path(self, start_node, end_node, weight):
+        costs = self.edge_costs(weight)
+        n = self.n_nodes
+        graph = csr_matrix((costs, self.indices, self.indptr), shape=(n, n))
+        _, pred = dijkstra(graph, indices=start_node, return_predecessors=True)
+        if start_node != end_node and pred[end_node] < 0:
+            return None
+
+        path = [end_node]
+        while path[-1] != start_node:
+            path.append(int(pred[path[-1]]))
+        path.reverse()
+
+        # 平行邊取成本最低的一條
+        edges = []
+        for u, v in zip(path[:-1], path[1:]):
+            lo, hi = self.indptr[u], self.indptr[u + 1]
+            candidates = lo + np.flatnonzero(self.indices[lo:hi] == v)
+            edges.append(int(candidates[np.argmin(costs[candidates])]))
+        return path, edges
+
+
+# ========== 記憶體比較 ==========
+# tracemalloc 看不到 GEOS 配置的記憶體，改讀 /proc/self/smaps_rollup，
+# 新舊兩種載入方式各自在獨立的子行程量測，互不影響：
+#   rss   常駐頁面總量
+#   anon  匿名頁面，每個 worker 各自一份、無法共用
+#   file  mmap 檔案頁面（rss - anon），由 page cache 在各 worker 間共用
+def process_memory(pid="self"):
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return {"rss": fields["Rss"], "anon": fields["Anonymous"], "file": fields["Rss"] - fields["Anonymous"]}
+
+
+def load_networkx_graph(pkl_path):
+    # 與舊版 load_graph 相同的載入流程，用於比較記憶體
+    with open(pkl_path, "rb") as f:
+        G = pickle.load(f)
+    transformer = Transformer.from_crs("epsg:3826", "epsg:4326", always_xy=True)
+    mapping = {}
+    for node in list(G.nodes):
+        lon, lat = transformer.transform(node[0], node[1])
+        mapping[(lat, lon)] = node
+        G.nodes[node]["latlon"] = (lat, lon)
+    G.graph['latlon_nodes'] = list(mapping.keys())
+    G.graph['node_lookup'] = mapping
+    return G
+
+
+def measure_load(kind, path):
+    # 在子行程內執行：量測載入前後的差值
+    import gc
+    import networkx  # noqa: F401  模組本身的記憶體不算在路網上
+
+    before = process_memory()
+    if kind == "networkx":
+        graph = load_networkx_graph(path)
+    else:
+        graph = CompactGraph(path)
+        graph.kdtree
+        # 讀過所有陣列，讓 mmap 頁面全部常駐，量到的是最壞情況
+        for arr in [graph.node_latlon, graph.indptr, graph.indices, graph.edge_geom,
+                    graph.geom_offsets, graph.geom_coords, *graph.attrs.values()]:
+            np.asarray(arr).sum()
+    gc.collect()
+    after = process_memory()
+    return graph, {k: after[k] - before[k] for k in after}
+
+
+def report_memory(pkl_path, out_dir):
+    import subprocess
+
+    MB = 1024 ** 2
+    source = source_fingerprint(pkl_path)
+    if not has_compact_graph(out_dir, source):
+        with open(pkl_path, "rb") as f:
+            build_compact_graph(pickle.load(f), out_dir, source)
+
+    results = {}
+    for kind, path in [("networkx", pkl_path), ("compact", out_dir)]:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", kind, path],
+                              capture_output=True, text=True, check=True)
+        results[kind] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    for kind, m in results.items():
+        print(f"{kind:<9}: rss {m['rss'] / MB:8.1f} MB = anon {m['anon'] / MB:8.1f} MB（每個 worker 一份）"
+              f" + file {m['file'] / MB:8.1f} MB（共用）")
+    meta = CompactGraph(out_dir).meta
+    print(f"nodes={meta['n_nodes']} edges={meta['n_edges']}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--measure":
+        _, usage = measure_load(sys.argv[2], sys.argv[3])
+        print(json.dumps(usage))
+    elif len(sys.argv) == 3:
+        report_memory(sys.argv[1], sys.argv[2])
+    else:
+        print("用法: python graph_store.py <路網.pkl> <輸出目錄>")
+        sys.exit(1)
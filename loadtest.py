@@ -0,0 +1,323 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+import numpy as np
+import requests
+import websockets
+from streamlit.proto.Alert_pb2 import Alert
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+import preload
+from graph_store import process_memory
+from graph_partition import PartitionedGraph
+
+# ========== 壓力測試 ==========
+# 啟動一個真正的 streamlit 伺服器（與正式部署相同，單一行程），再開 N 個 websocket 連線
+# 同時連到 /_stcore/stream，像瀏覽器一樣送出 BackMsg 依序操作 app.py：
+# 點地圖設定起終點、清空、輸入地址、路徑解算、調整權重、切換疊圖。
+# 量到的是單一 streamlit 實例在 N 個同時使用者下的延遲、吞吐量與伺服器記憶體成長。
+# 伺服器行程內的地理編碼改由本機假資料回應，不會呼叫 Google API。請在專案根目錄執行：
+#   python loadtest.py --sessions 20 --concurrency 10
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(ROOT, "app.py")
+ADDRESS_PREFIX = "模擬地址"
+STEPS = ["load", "map_click", "clear", "type_address", "route", "slider", "overlay"]
+ALERT_STEPS = {"type_address", "route"}   # 這些步驟出現 st.warning / st.error 也算失敗
+
+
+# ========== 本機地理編碼（伺服器行程內） ==========
+# 地址字串直接帶座標，反查得到的地址也能再查回座標
+def fake_address(lat, lon):
+    return f"{ADDRESS_PREFIX} {lat:.6f},{lon:.6f}"
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+class FakeGeocoder:
+    def get(self, url, params=None, **kwargs):
+        params = params or {}
+        if "latlng" in params:
+            lat, lon = map(float, params["latlng"].split(","))
+            return FakeResponse({"status": "OK", "results": [{"formatted_address": fake_address(lat, lon)}]})
+        address = params.get("address", "").removeprefix("台灣 ")
+        if not address.startswith(ADDRESS_PREFIX):
+            return FakeResponse({"status": "ZERO_RESULTS"})
+        lat, lon = map(float, address.removeprefix(ADDRESS_PREFIX).split(","))
+        return FakeResponse({"status": "OK", "results": [{"geometry": {"location": {"lat": lat, "lng": lon}}}]})
+
+
+def serve(port, health_port):
+    from streamlit.web import cli as stcli
+
+    requests.get = FakeGeocoder().get
+    preload.start()
+    preload.serve_health(health_port)
+    sys.argv = ["streamlit", "run", APP_PATH, "--server.port", str(port), "--server.headless", "true",
+                "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"]
+    sys.exit(stcli.main())
+
+
+# ========== 伺服器行程 ==========
+def start_server(port, health_port, log_path=None):
+    log = open(log_path, "w") if log_path else subprocess.DEVNULL
+    cmd = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port), "--health-port", str(health_port)]
+    return subprocess.Popen(cmd, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(proc, port, health_port, timeout=1800):
+    # 先等路網預載完成，再等 streamlit 開始接受連線
+    deadline = time.time() + timeout
+    for url in [f"http://127.0.0.1:{health_port}/ready", f"http://127.0.0.1:{port}/_stcore/health"]:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"伺服器已結束（exit {proc.returncode}）")
+            if time.time() > deadline:
+                raise TimeoutError(f"等待 {url} 逾時")
+            try:
+                with urllib.request.urlopen(url, timeout=5):
+                    break
+            except urllib.error.HTTPError as e:
+                body = json.loads(e.read() or b"{}")
+                if body.get("status") == "error":
+                    raise RuntimeError(f"路網載入失敗：{body['error']}")
+            except OSError:
+                pass
+            time.sleep(0.5)
+
+
+# ========== 模擬瀏覽器 ==========
+class ScriptError(Exception):
+    pass
+
+
+class BrowserSession:
+    # 記住畫面上目前有哪些元件，並像前端一樣在每次重新執行時送出元件的值
+    def __init__(self, ws, timeout):
+        self.ws = ws
+        self.timeout = timeout
+        self.page_script_hash = ""
+        self.widgets = {}
+        self.values = {}
+        self.exceptions = []
+        self.alerts = []
+
+    async def rerun(self, trigger=None):
+        msg = BackMsg()
+        state = msg.rerun_script
+        state.page_script_hash = self.page_script_hash
+        state.widget_states.widgets.extend(v for wid, v in self.values.items() if wid in self.widgets)
+        if trigger is not None:
+            state.widget_states.widgets.append(trigger)
+        await self.ws.send(msg.SerializeToString())
+        await asyncio.wait_for(self._receive_run(), self.timeout)
+        if self.exceptions:
+            raise ScriptError(self.exceptions[0])
+
+    async def _receive_run(self):
+        # 收到腳本執行完畢為止；st.rerun() 造成的提前結束之後還會再跑一次
+        while True:
+            msg = ForwardMsg()
+            msg.ParseFromString(await self.ws.recv())
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                self.page_script_hash = msg.new_session.page_script_hash
+                self.widgets, self.exceptions, self.alerts = {}, [], []
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                element = msg.delta.new_element
+                proto = getattr(element, element.WhichOneof("type"))
+                if element.WhichOneof("type") == "exception":
+                    self.exceptions.append(proto.message)
+                elif element.WhichOneof("type") == "alert" and proto.format in (Alert.WARNING, Alert.ERROR):
+                    self.alerts.append(proto.body)
+                elif getattr(proto, "id", ""):
+                    self.widgets[proto.id] = (element.WhichOneof("type"), proto)
+            elif kind == "script_finished" and msg.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                return
+
+    def find(self, element_type, match):
+        return next(wid for wid, (t, proto) in self.widgets.items() if t == element_type and match(wid, proto))
+
+    def by_key(self, element_type, key):
+        return self.find(element_type, lambda wid, proto: wid.endswith(f"-{key}"))
+
+    def set_value(self, wid, field, value):
+        state = WidgetState(id=wid)
+        if field == "double_array_value":
+            state.double_array_value.data.extend(value)
+        else:
+            setattr(state, field, value)
+        self.values[wid] = state
+
+    async def click_map(self, latlon):
+        wid = self.find("component_instance", lambda wid, proto: "st_folium" in proto.component_name)
+        self.set_value(wid, "json_value", json.dumps({"last_clicked": {"lat": latlon[0], "lng": latlon[1]}}))
+        await self.rerun()
+
+    async def click_button(self, label):
+        wid = self.find("button", lambda wid, proto: proto.label == label)
+        await self.rerun(WidgetState(id=wid, trigger_value=True))
+
+    async def input_text(self, key, text):
+        self.set_value(self.by_key("text_input", key), "string_value", text)
+        await self.rerun()
+
+    async def set_slider(self, key, value):
+        self.set_value(self.by_key("slider", key), "double_array_value", [value])
+        await self.rerun()
+
+    async def set_radio(self, key, option):
+        self.set_value(self.by_key("radio", key), "string_value", option)
+        await self.rerun()
+
+
+def random_latlon(G, rng):
+    weights = np.array([p["n_nodes"] for p in G.partitions], dtype=np.float64)
+    pid = G.partitions[rng.choices(range(len(weights)), weights=weights)[0]]["id"]
+    part = G.partition(pid)
+    return part.latlon(rng.randrange(part.n_nodes))
+
+
+# ========== 單一使用者流程 ==========
+async def run_session(url, sid, G, seed, timeout, timings, errors, active, finished, hold):
+    rng = random.Random(seed + sid)
+    start, end = random_latlon(G, rng), random_latlon(G, rng)
+    try:
+        async with websockets.connect(url, subprotocols=["streamlit"], max_size=None, max_queue=None) as ws:
+            session = BrowserSession(ws, timeout)
+
+            async def step(name, action):
+                # 找不到元件、逾時、腳本例外都算該步驟失敗，繼續下一步；
+                # 地址與路徑解算若以警告或錯誤訊息結束（例如離路網太遠、找不到路徑）也算失敗
+                t0 = time.perf_counter()
+                try:
+                    await action()
+                    failed = name in ALERT_STEPS and bool(session.alerts)
+                except Exception:
+                    failed = True
+                timings[name].append(time.perf_counter() - t0)
+                if failed:
+                    errors[name] += 1
+
+            async with active:
+                await step("load", session.rerun)
+                await step("map_click", lambda: session.click_map(start))
+                await step("map_click", lambda: session.click_map(end))
+                await step("clear", lambda: session.click_button("🔃 清空選擇"))
+                await step("type_address", lambda: session.input_text("start_address", fake_address(*start)))
+                await step("type_address", lambda: session.input_text("end_address", fake_address(*end)))
+                await step("route", lambda: session.click_button("🧭 路徑解算"))
+                for key in ["pm25_weight", "no2_weight", "WBGT_weight"]:
+                    await step("slider", lambda key=key: session.set_slider(key, rng.randrange(0, 101, 10)))
+                for option in ["PM₂.₅", "NO₂", "氣溫", "無"]:
+                    await step("overlay", lambda option=option: session.set_radio("active_overlay_radio", option))
+            # 量測記憶體前保持連線，讓伺服器端的 session 仍然存活
+            finished.set()
+            await hold.wait()
+    finally:
+        finished.set()
+
+
+async def run_sessions(url, sids, G, seed, concurrency, timeout, measure):
+    timings, errors = defaultdict(list), defaultdict(int)
+    active = asyncio.Semaphore(concurrency)
+    hold = asyncio.Event()
+    finished = [asyncio.Event() for _ in sids]
+    tasks = [asyncio.create_task(run_session(url, sid, G, seed, timeout, timings, errors, active, done, hold))
+             for sid, done in zip(sids, finished)]
+    t_start = time.time()
+    await asyncio.gather(*(done.wait() for done in finished))
+    wall = time.time() - t_start
+    memory = measure()
+    hold.set()
+    await asyncio.gather(*tasks)
+    return timings, errors, wall, memory
+
+
+# ========== 報表 ==========
+def summarize(timings, errors, wall, rss_growth, sessions, concurrency):
+    report = {"sessions": sessions, "concurrency": concurrency, "wall_s": wall, "steps": {}}
+    total = 0
+    for name in STEPS:
+        samples = np.array(timings.get(name, []))
+        if not len(samples):
+            continue
+        total += len(samples)
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000
+        report["steps"][name] = {
+            "count": len(samples), "errors": errors.get(name, 0),
+            "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+        }
+    report["throughput_steps_per_s"] = total / wall
+    report["throughput_sessions_per_s"] = sessions / wall
+    report["rss_growth_mb"] = rss_growth / 1024 ** 2
+    report["rss_growth_per_session_mb"] = report["rss_growth_mb"] / sessions
+    return report
+
+
+def print_report(report):
+    print(f"{'step':<14}{'count':>7}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, s in report["steps"].items():
+        print(f"{name:<14}{s['count']:>7}{s['errors']:>5}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}")
+    print(f"sessions={report['sessions']}  concurrency={report['concurrency']}  wall={report['wall_s']:.1f}s  "
+          f"throughput={report['throughput_steps_per_s']:.2f} steps/s, {report['throughput_sessions_per_s']:.2f} sessions/s")
+    print(f"伺服器 RSS 成長 {report['rss_growth_mb']:.1f} MB，每個 session {report['rss_growth_per_session_mb']:.2f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以多個同時連線操作單一 streamlit 伺服器上的 app.py")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=None, help="同時操作的使用者數，預設等於 --sessions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--health-port", type=int, default=8598)
+    parser.add_argument("--timeout", type=float, default=120, help="單一步驟的逾時秒數")
+    parser.add_argument("--server-log", help="伺服器輸出另存的路徑")
+    parser.add_argument("--json", help="另存 JSON 報表的路徑")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.health_port)
+
+    url = f"ws://127.0.0.1:{args.port}/_stcore/stream"
+    concurrency = args.concurrency or args.sessions
+    proc = start_server(args.port, args.health_port, args.server_log)
+    try:
+        wait_ready(proc, args.port, args.health_port)
+        G = PartitionedGraph(os.path.join(ROOT, preload.PARTITION_DIR))
+
+        # 第一個 session 只用來載入模組與快取，不計入測量
+        asyncio.run(run_sessions(url, [-1], G, args.seed, 1, args.timeout, lambda: None))
+        rss_before = process_memory(proc.pid)["rss"]
+        timings, errors, wall, memory = asyncio.run(run_sessions(
+            url, range(args.sessions), G, args.seed, concurrency, args.timeout, lambda: process_memory(proc.pid)))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    report = summarize(timings, errors, wall, memory["rss"] - rss_before, args.sessions, concurrency)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
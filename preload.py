@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import time
+import pickle
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from graph_store import CompactGraph, build_compact_graph, build_lock, has_compact_graph, source_fingerprint
+from graph_partition import PartitionedGraph, build_partitions, has_partitions, make_gid
+
+# ========== 預先載入 ==========
+# 伺服器啟動時在背景執行緒建好路網、空間索引與路徑引擎，第一位使用者不必等待。
+#   python preload.py [streamlit 參數]   先開始預載與健康檢查端點，再啟動 streamlit
+#   streamlit run app.py                 第一次執行腳本時才開始預載，介面顯示載入中
+PKL_PATH = r"data/雙北基隆路網_濃度與暴露_最大連通版.pkl"
+GRAPH_DIR = r"data/雙北基隆路網_compact"
+PARTITION_DIR = r"data/雙北基隆路網_partitions"
+HEALTH_PORT = int(os.environ.get("PRELOAD_HEALTH_PORT", 8502))
+DEFAULT_WEIGHTS = {"PM25_expo": 50, "NO2_expo": 30, "WBGT_expo": 80}   # 介面滑桿的預設權重（%）
+
+_lock = threading.Lock()
+_thread = None
+_graph = None
+_state = {"status": "idle", "error": None, "started_at": None, "ready_at": None}
+
+
+def load_graph():
+    # 第一次啟動時把 networkx pickle 轉成精簡格式並依網格分區，
+    # 之後只載入查詢用到的分區，各 worker 以 mmap 共用；pickle 更新後重建
+    source = source_fingerprint(PKL_PATH)
+    with build_lock(GRAPH_DIR):
+        if not has_compact_graph(GRAPH_DIR, source):
+            with open(PKL_PATH, "rb") as f:
+                build_compact_graph(pickle.load(f), GRAPH_DIR, source)
+    with build_lock(PARTITION_DIR):
+        if not has_partitions(PARTITION_DIR, source):
+            build_partitions(CompactGraph(GRAPH_DIR), PARTITION_DIR)
+    return PartitionedGraph(PARTITION_DIR)
+
+
+def route_weight(weights):
+    # 滑桿百分比正規化成路徑權重；全部為 0 時只看距離
+    total = sum(weights.values())
+    if total == 0:
+        return "length"
+    return {k: w / total for k, w in weights.items()}
+
+
+def warm_up(G):
+    # 節點最多（通常是市中心）的分區先載入並建好 KDTree，
+    # 再以介面第一次路徑解算會用到的兩種權重，跑一次跨分區的路徑計算
+    busiest = sorted(G.partitions, key=lambda p: p["n_nodes"], reverse=True)[:2]
+    part = G.partition(busiest[0]["id"])
+    part.kdtree
+    start = make_gid(busiest[0]["id"], 0)
+    end = make_gid(busiest[-1]["id"], busiest[-1]["n_nodes"] - 1)
+    for weight in ["length", route_weight(DEFAULT_WEIGHTS)]:
+        G.shortest_path(start, end, weight)
+
+
+def _run():
+    global _graph, _thread
+    try:
+        G = load_graph()
+        warm_up(G)
+    except Exception as e:
+        # 清掉執行緒，之後再呼叫 start() 會重新載入
+        with _lock:
+            _thread = None
+            _state.update(status="error", error=f"{type(e).__name__}: {e}")
+        return
+    with _lock:
+        _graph = G
+        _state.update(status="ready", ready_at=time.time())
+
+
+def start():
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return
+        _state.update(status="loading", error=None, started_at=time.time())
+        _thread = threading.Thread(target=_run, name="graph-preload", daemon=True)
+        _thread.start()
+
+
+def get_graph():
+    return _graph
+
+
+def status():
+    with _lock:
+        return dict(_state)
+
+
+# ========== 健康檢查端點 ==========
+class HealthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        state = status()
+        if self.path == "/ready":
+            code = 200 if state["status"] == "ready" else 503
+        elif self.path == "/health":
+            code = 500 if state["status"] == "error" else 200
+        else:
+            self.send_error(404)
+            return
+        body = json.dumps(state).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_health(port=HEALTH_PORT):
+    server = ThreadingHTTPServer(("", port), HealthHandler)
+    threading.Thread(target=server.serve_forever, name="preload-health", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    from streamlit.web import cli as stcli
+    # 以模組名稱匯入，app.py 的 import preload 才會拿到同一份狀態
+    import preload
+
+    preload.start()
+    preload.serve_health()
+    sys.argv = ["streamlit", "run", "app.py", *sys.argv[1:]]
+    sys.exit(stcli.main())
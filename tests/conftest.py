@@ -0,0 +1,62 @@
+import os
+import sys
+import random
+
+import networkx as nx
+import pytest
+from shapely.geometry import LineString
+from pyproj import Transformer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph_store import CompactGraph, build_compact_graph  # noqa: E402
+from graph_partition import PartitionedGraph, build_partitions  # noqa: E402
+
+
+# ========== 合成路網 ==========
+# 30 x 30 的格狀路網（TWD97 座標，間距 80 公尺），隨機缺邊、部分路段沒有幾何，
+# 暴露值隨機，保留最大連通分量
+def synthetic_graph(size=30, seed=1):
+    rng = random.Random(seed)
+    transformer = Transformer.from_crs("epsg:3826", "epsg:4326", always_xy=True)
+
+    def node(i, j):
+        return (300000.0 + i * 80, 2770000.0 + j * 80)
+
+    G = nx.Graph()
+    for i in range(size):
+        for j in range(size):
+            for di, dj in ((1, 0), (0, 1)):
+                if i + di >= size or j + dj >= size or rng.random() > 0.9:
+                    continue
+                a, b = node(i, j), node(i + di, j + dj)
+                attrs = {
+                    "length": 80 + rng.random(),
+                    "PM25_expo": rng.random() * 20,
+                    "NO2_expo": rng.random() * 10,
+                    "WBGT_expo": rng.random() * 30,
+                }
+                if rng.random() < 0.8:
+                    attrs["geometry"] = LineString([transformer.transform(*a), transformer.transform(*b)])
+                G.add_edge(a, b, attr_dict=attrs)
+    return G.subgraph(max(nx.connected_components(G), key=len)).copy()
+
+
+@pytest.fixture(scope="session")
+def nx_graph():
+    return synthetic_graph()
+
+
+@pytest.fixture(scope="session")
+def compact_graph(nx_graph, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("graph") / "compact")
+    build_compact_graph(nx_graph, path)
+    return CompactGraph(path)
+
+
+@pytest.fixture(scope="session")
+def partitioned_graph(compact_graph, tmp_path_factory):
+    # 約 5 x 5 個分區，查詢大多跨越多個分區
+    path = str(tmp_path_factory.mktemp("graph") / "partitions")
+    build_partitions(compact_graph, path, tile_deg=0.005)
+    return PartitionedGraph(path, max_resident=4)
@@ -0,0 +1,76 @@
+import os
+import math
+
+import numpy as np
+import pytest
+
+from exposure_tiles import COLORS, EXTENT, LAYER_NAME, build_exposure_tiles, encode_tile, load_tile_meta
+
+mapbox_vector_tile = pytest.importorskip("mapbox_vector_tile")
+
+
+def decode(data):
+    # 保持 MVT 原本的 y 軸向下，方便和輸入座標比較
+    return mapbox_vector_tile.decode(data, default_options={"y_coord_down": True})
+
+
+def tile_of(lat, lon, z):
+    n = 2 ** z
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    return int(x), int(y)
+
+
+def test_encode_tile_round_trip():
+    coords = np.array([[10, 20], [300, 20], [300, 4000]])
+    layers = decode(encode_tile([(coords, {"value": 1.5, "color": "#d73027"})]))
+    layer = layers[LAYER_NAME]
+    assert layer["extent"] == EXTENT
+    [feature] = layer["features"]
+    assert feature["geometry"]["type"] == "LineString"
+    assert feature["geometry"]["coordinates"] == coords.tolist()
+    assert feature["properties"] == {"value": 1.5, "color": "#d73027"}
+
+
+@pytest.fixture(scope="module")
+def tile_dir(compact_graph, tmp_path_factory):
+    out_root = str(tmp_path_factory.mktemp("tiles"))
+    build_exposure_tiles(compact_graph, out_root, min_zoom=12, max_zoom=14, attrs=["PM25_expo"])
+    return out_root
+
+
+def test_tile_meta(tile_dir):
+    meta = load_tile_meta("PM25_expo", tile_dir)
+    assert meta["layer"] == LAYER_NAME
+    assert (meta["min_zoom"], meta["max_zoom"]) == (12, 14)
+    assert meta["colors"] == COLORS
+    assert len(meta["breaks"]) == len(COLORS) - 1
+    assert meta["breaks"] == sorted(meta["breaks"])
+    assert load_tile_meta("NO2_expo", tile_dir) is None
+
+
+@pytest.mark.parametrize("z", [12, 13, 14])
+def test_tiles_decode(compact_graph, tile_dir, z):
+    meta = load_tile_meta("PM25_expo", tile_dir)
+    latlon = np.asarray(compact_graph.node_latlon, dtype=np.float64)
+    expected = {tile_of(lat, lon, z) for lat, lon in latlon}
+
+    zoom_dir = os.path.join(tile_dir, "PM25_expo", str(z))
+    found = set()
+    for x in os.listdir(zoom_dir):
+        for name in os.listdir(os.path.join(zoom_dir, x)):
+            y = int(name.removesuffix(".pbf"))
+            found.add((int(x), y))
+            with open(os.path.join(zoom_dir, x, name), "rb") as f:
+                layer = decode(f.read())[LAYER_NAME]
+            assert layer["extent"] == EXTENT
+            assert layer["features"]
+            for feature in layer["features"]:
+                assert feature["geometry"]["type"] in ("LineString", "MultiLineString")
+                assert feature["properties"]["color"] in meta["colors"]
+                assert feature["properties"]["value"] >= 0
+
+    # 每個有節點的圖磚都要有檔案，圖磚也不會落在路網範圍之外太遠
+    assert expected <= found
+    xs, ys = zip(*expected)
+    assert all(min(xs) - 1 <= x <= max(xs) + 1 and min(ys) - 1 <= y <= max(ys) + 1 for x, y in found)
@@ -0,0 +1,63 @@
+import random
+
+import networkx as nx
+import pytest
+
+WEIGHTS = [
+    "length",
+    "NO2_expo",
+    {"WBGT_expo": 1.0, "PM25_expo": 0},
+    {"PM25_expo": 0.5, "NO2_expo": 0.3, "WBGT_expo": 0.2},
+]
+
+
+def nx_weight(weight):
+    if isinstance(weight, dict):
+        return lambda u, v, d: sum(d["attr_dict"][k] * w for k, w in weight.items())
+    return lambda u, v, d: d["attr_dict"][weight]
+
+
+def path_cost(totals, weight):
+    if isinstance(weight, dict):
+        return sum(totals[k] * w for k, w in weight.items())
+    return totals[weight]
+
+
+def random_pairs(n, count=15, seed=0):
+    rng = random.Random(seed)
+    return [(rng.randrange(n), rng.randrange(n)) for _ in range(count)]
+
+
+@pytest.mark.parametrize("weight", WEIGHTS, ids=str)
+def test_compact_graph_matches_networkx(nx_graph, compact_graph, weight):
+    nodes = list(nx_graph.nodes)
+    for s, t in random_pairs(compact_graph.n_nodes):
+        expected = nx.shortest_path_length(nx_graph, nodes[s], nodes[t], weight=nx_weight(weight))
+        path, edges = compact_graph.shortest_path(s, t, weight)
+        assert path[0] == s and path[-1] == t
+        assert path_cost(compact_graph.path_totals(edges), weight) == pytest.approx(expected, rel=1e-5)
+
+
+@pytest.mark.parametrize("weight", WEIGHTS, ids=str)
+def test_partitioned_graph_matches_networkx(nx_graph, compact_graph, partitioned_graph, weight):
+    nodes = list(nx_graph.nodes)
+    for s, t in random_pairs(compact_graph.n_nodes):
+        expected = nx.shortest_path_length(nx_graph, nodes[s], nodes[t], weight=nx_weight(weight))
+        start = partitioned_graph.nearest_node(*compact_graph.latlon(s))
+        end = partitioned_graph.nearest_node(*compact_graph.latlon(t))
+        path, edges = partitioned_graph.shortest_path(start, end, weight)
+        assert path_cost(partitioned_graph.path_totals(edges), weight) == pytest.approx(expected, rel=1e-5)
+
+        # 邊依序首尾相接
+        assert path[0] == start and path[-1] == end
+        for edge, (u, v) in zip(edges, zip(path[:-1], path[1:])):
+            assert partitioned_graph.edge_endpoints(edge) == (u, v)
+
+
+def test_partitioned_graph_respects_resident_cap(compact_graph, partitioned_graph):
+    assert partitioned_graph.n_partitions > partitioned_graph.max_resident
+    for s, t in random_pairs(compact_graph.n_nodes, seed=1):
+        start = partitioned_graph.nearest_node(*compact_graph.latlon(s))
+        end = partitioned_graph.nearest_node(*compact_graph.latlon(t))
+        partitioned_graph.shortest_path(start, end, {"PM25_expo": 0.6, "WBGT_expo": 0.4})
+        assert len(partitioned_graph.resident_partitions()) <= partitioned_graph.max_resident
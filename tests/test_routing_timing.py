@@ -0,0 +1,42 @@
+import time
+import random
+
+import numpy as np
+import pytest
+
+from conftest import synthetic_graph
+from graph_store import CompactGraph, build_compact_graph
+from graph_partition import PartitionedGraph, build_partitions
+
+
+# ========== 權重組合的查詢時間 ==========
+# 滑桿每動一次就是新的權重組合，不能依賴快取；分區查詢的時間應與整張精簡路網同一量級
+@pytest.fixture(scope="module")
+def large_graphs(tmp_path_factory):
+    root = tmp_path_factory.mktemp("large")
+    build_compact_graph(synthetic_graph(size=120), str(root / "compact"))
+    CG = CompactGraph(str(root / "compact"))
+    build_partitions(CG, str(root / "partitions"), tile_deg=0.02)
+    return CG, PartitionedGraph(str(root / "partitions"), max_resident=4)
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+
+def test_new_weight_mix_is_fast(large_graphs):
+    CG, PG = large_graphs
+    latlon = np.asarray(CG.node_latlon, dtype=np.float64)
+    s, t = int(np.argmin(latlon.sum(axis=1))), int(np.argmax(latlon.sum(axis=1)))
+    start, end = PG.nearest_node(*CG.latlon(s)), PG.nearest_node(*CG.latlon(t))
+    assert PG.n_partitions > 9
+
+    rng = random.Random(0)
+    compact, partitioned = [], []
+    for _ in range(5):
+        weight = {"PM25_expo": rng.random(), "NO2_expo": rng.random(), "WBGT_expo": rng.random()}
+        compact.append(timed(CG.shortest_path, s, t, weight))
+        partitioned.append(timed(PG.shortest_path, start, end, weight))
+    assert np.median(partitioned) < 10 * np.median(compact) + 0.1, (compact, partitioned)